@@ -1,11 +1,39 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Optional
 
 class Settings(BaseSettings):
     HOST: str = "0.0.0.0"
     PORT: int = 3001
+    # Production worker processes (0 = one per available CPU with Redis, else 1)
+    WORKERS: int = 0
+    # Hottest cache entries loaded into each worker on boot (needs REDIS_URL)
+    CACHE_WARM_KEYS: int = 500
     MOODLE_URL: str = "https://moodle.example.com"
     MOODLE_SERVICE: str = "moodle_mobile_app"
+    # Origin for image proxy URLs in served content (default: the request's base URL)
+    PUBLIC_BASE_URL: str = ""
+    REDIS_URL: Optional[str] = None
+
+    # Concurrent file downloads per activity
+    ACTIVITY_FILE_CONCURRENCY: int = 4
+
+    # Upstream Moodle scheduling, split evenly across worker processes
+    # (per user, never below ACTIVITY_FILE_CONCURRENCY per worker)
+    UPSTREAM_MAX_CONCURRENCY: int = 32
+    UPSTREAM_PER_USER_LIMIT: int = 6
+
+    # Image proxy
+    IMAGE_CACHE_DIR: str = "/tmp/mylms-images"
+    IMAGE_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+    IMAGE_MAX_WIDTH: int = 1600
+    # Signs proxy image URLs; must be the same on every worker and replica
+    IMAGE_PROXY_SECRET: str = ""
+    IMAGE_URL_TTL: int = 24 * 3600
+
+    # Book catalogue
+    CATALOGUE_DB_PATH: str = "catalogue.db"
+    CATALOGUE_DOWNLOAD_URL: str = "https://libgen.is/get.php?md5={md5}"
 
     class Config:
         env_file = ".env"
@@ -1,11 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
-from pydantic import BaseModel
-from typing import List, Optional, Any
+from pydantic import BaseModel, Field
+from typing import Annotated, List, Optional, Any
 from app.services.libgen import LibGenClient
 from app.dependencies import get_libgen_client
 
 router = APIRouter()
 
+# Detection is unauthenticated, so bound the work a single request can ask for
+MAX_DETECT_HTML_CHARS = 1_000_000
+MAX_DETECT_DOCUMENTS = 50
+
+DetectHtml = Annotated[str, Field(max_length=MAX_DETECT_HTML_CHARS)]
+
 class SearchResponse(BaseModel):
     success: bool
     results: Optional[Any] = None
@@ -17,19 +23,30 @@ class DownloadResponse(BaseModel):
     error: Optional[str] = None
 
 class DetectRequest(BaseModel):
-    html: str
+    html: DetectHtml = ""
+    # Activity the HTML was served for; reuses detection from when it was cached
+    url: Optional[str] = None
 
 class DetectResponse(BaseModel):
     success: bool
     books: List[Any]
 
+class DetectBatchRequest(BaseModel):
+    documents: List[DetectHtml] = Field(max_length=MAX_DETECT_DOCUMENTS)
+
+class DetectBatchResponse(BaseModel):
+    success: bool
+    results: List[List[Any]]
+
 @router.get("/search", response_model=SearchResponse)
 async def search_books(
     q: str,
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=100),
     client: LibGenClient = Depends(get_libgen_client)
 ):
     try:
-        results = await client.search(q)
+        results = await client.search(q, page=page, limit=limit)
         return SearchResponse(
             success=True,
             results=results
@@ -62,8 +79,19 @@ async def detect_books(
     request: DetectRequest,
     client: LibGenClient = Depends(get_libgen_client)
 ):
-    books = await client.detect_books_from_html(request.html)
+    books = await client.detect_books_from_html(request.html, request.url)
     return DetectResponse(
         success=True,
         books=books
     )
+
+@router.post("/detect/batch", response_model=DetectBatchResponse)
+async def detect_books_batch(
+    request: DetectBatchRequest,
+    client: LibGenClient = Depends(get_libgen_client)
+):
+    results = await client.detect_books_batch(request.documents)
+    return DetectBatchResponse(
+        success=True,
+        results=results
+    )
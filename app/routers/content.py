@@ -1,11 +1,22 @@
 import asyncio
+import json
 import re
-from fastapi import APIRouter, Depends, HTTPException, Query
+from dataclasses import dataclass, field
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from app.services.moodle import MoodleClient
 from app.services.cleaner import clean_html_with_token
-from app.services.cache import cache
+from app.services.cache import cache, content_tags
+from app.config import settings
+from app.services.detector import detect_books, merge_books, store_activity_detection
+from app.services.scheduler import Priority, scheduler, upstream_priority
+from app.services.search import content_index
+from app.services.images import (
+    CachedImage, ImageAuthError, ImageFetchError, image_cache, is_moodle_url, resolve_grant, sign_image_urls
+)
 from app.dependencies import get_moodle_client, get_token
 import logging
 
@@ -33,13 +44,75 @@ class BatchPrefetchResponse(BaseModel):
     loaded: int
     items: List[BatchPrefetchItem]
 
+@dataclass
+class ActivityContent:
+    html: str
+    course_id: int
+    cmid: int
+    name: Optional[str] = None
+    books: List[Dict[str, str]] = field(default_factory=list)
+
+class SearchResult(BaseModel):
+    url: str
+    course_id: int
+    cmid: int
+    name: Optional[str] = None
+    score: float
+    snippet: str
+
+class SearchResponse(BaseModel):
+    success: bool
+    results: List[SearchResult] = []
+    error: Optional[str] = None
+
+# How long a user's enrolled course ids are reused for search scoping
+USER_COURSES_TTL = 300
+
+ACTIVITY_TTL = 3600
+
+# Fragments are keyed by file modification time, so they can live longer
+FRAGMENT_TTL = 24 * 3600
+
 def extract_module_id(url: str) -> Optional[int]:
     match = re.search(r"[?&]id=(\d+)", url)
     if match:
         return int(match.group(1))
     return None
 
-async def fetch_activity_content(client: MoodleClient, token: str, url: str) -> str:
+def process_fragment(raw_html: str, token: str, base_url: str) -> Tuple[str, List[Dict[str, str]]]:
+    """
+    Clean one HTML file and detect books in it. Detection runs on the raw
+    file because cleaning strips the prescribed reading boxes.
+    """
+    return clean_html_with_token(raw_html, token, base_url), detect_books(raw_html)
+
+async def fetch_fragment(
+    client: MoodleClient,
+    token: str,
+    fileurl: str,
+    filename: str,
+    timemodified: Optional[int],
+    tags: List[str]
+) -> Optional[Tuple[str, List[Dict[str, str]]]]:
+    # Keyed by modification time so only changed files are re-fetched
+    cache_key = f"fragment:{cache.url_hash(fileurl)}:{timemodified or 0}"
+    
+    cached_fragment = await cache.get(cache_key)
+    if cached_fragment:
+        fragment = json.loads(cached_fragment)
+        return fragment["html"], fragment["books"]
+    
+    content = await client.download_file(token, fileurl)
+    if not content:
+        logger.warning(f"Failed to download {filename}")
+        return None
+    
+    html, books = await asyncio.to_thread(process_fragment, content, token, fileurl)
+    if timemodified:
+        await cache.set(cache_key, json.dumps({"html": html, "books": books}), ttl=FRAGMENT_TTL, tags=tags)
+    return html, books
+
+async def fetch_activity_content(client: MoodleClient, token: str, url: str) -> ActivityContent:
     cmid = extract_module_id(url)
     if not cmid:
         raise ValueError("Invalid URL: Could not extract module ID")
@@ -67,7 +140,7 @@ async def fetch_activity_content(client: MoodleClient, token: str, url: str) ->
                     if filename.endswith(".html") or filename.endswith(".htm"):
                         fileurl = content.get("fileurl")
                         if fileurl:
-                            html_files.append((fileurl, content.get("filename")))
+                            html_files.append((fileurl, content.get("filename"), content.get("timemodified")))
                 found_module = True
                 break
         if found_module:
@@ -78,48 +151,76 @@ async def fetch_activity_content(client: MoodleClient, token: str, url: str) ->
         content = await client.download_file(token, url)
         if not content:
             raise ValueError("No content found and direct download failed")
-        return content
-        
-    combined_html = []
-    for fileurl, filename in html_files:
-        content = await client.download_file(token, fileurl)
-        if content:
-            combined_html.append(content)
-        else:
-            logger.warning(f"Failed to download {filename}")
+        html, books = await asyncio.to_thread(process_fragment, content, token, url)
+        return ActivityContent(html, course_id, cmid, cm.get("name"), books)
+    
+    # Fetch files concurrently (bounded per activity); gather keeps file order
+    semaphore = asyncio.Semaphore(settings.ACTIVITY_FILE_CONCURRENCY)
+    tags = content_tags("fragment", course_id, cmid)
+    
+    async def sem_fetch(fileurl, filename, timemodified):
+        async with semaphore:
+            return await fetch_fragment(client, token, fileurl, filename, timemodified, tags)
+    
+    fragments = await asyncio.gather(*[sem_fetch(*f) for f in html_files])
+    fragments = [f for f in fragments if f]
             
-    if not combined_html:
+    if not fragments:
         raise ValueError("Failed to download any HTML content files")
         
-    return "\n\n".join(combined_html)
+    return ActivityContent(
+        "\n\n".join(html for html, _ in fragments),
+        course_id,
+        cmid,
+        cm.get("name"),
+        merge_books(books for _, books in fragments)
+    )
 
-@router.get("/activity", response_model=ContentResponse)
-async def get_activity_content(
-    url: str,
-    token: str = Depends(get_token),
-    client: MoodleClient = Depends(get_moodle_client)
-):
+def public_base_url(request: Request) -> str:
+    """
+    Origin clients reach this server on, for absolute image proxy URLs
+    """
+    return settings.PUBLIC_BASE_URL or str(request.base_url).rstrip("/")
+
+async def load_activity_content(client: MoodleClient, token: str, url: str, base_url: str) -> Tuple[str, bool]:
+    """
+    Return cleaned activity content and whether it came from the cache
+    """
     cache_key = f"activity:{cache.url_hash(url)}"
+    cache.track(cache_key)
     
     # Check cache
     cached_content = await cache.get(cache_key)
     if cached_content:
-        return ContentResponse(
-            success=True,
-            content=cached_content,
-            cached=True
-        )
+        # Content may have been cached by another worker or before a restart
+        await content_index.ensure_indexed(cache_key, cached_content)
+        return await sign_image_urls(cached_content, token, base_url), True
     
+    activity = await fetch_activity_content(client, token, url)
+    
+    tags = content_tags("activity", activity.course_id, activity.cmid)
+    await cache.set(cache_key, activity.html, ttl=ACTIVITY_TTL, tags=tags)
+    await store_activity_detection(url, activity.books, content_tags("books", activity.course_id, activity.cmid))
+    await content_index.add(
+        cache_key, url, activity.course_id, activity.cmid, activity.name, activity.html, ACTIVITY_TTL, tags
+    )
+    
+    return await sign_image_urls(activity.html, token, base_url), False
+
+@router.get("/activity", response_model=ContentResponse)
+async def get_activity_content(
+    request: Request,
+    url: str,
+    token: str = Depends(get_token),
+    client: MoodleClient = Depends(get_moodle_client)
+):
     try:
-        raw_content = await fetch_activity_content(client, token, url)
-        cleaned_content = clean_html_with_token(raw_content, token)
-        
-        await cache.set(cache_key, cleaned_content)
+        content, cached = await load_activity_content(client, token, url, public_base_url(request))
         
         return ContentResponse(
             success=True,
-            content=cleaned_content,
-            cached=False
+            content=content,
+            cached=cached
         )
     except Exception as e:
         logger.error(f"Error fetching content: {e}")
@@ -129,33 +230,63 @@ async def get_activity_content(
             cached=False
         )
 
+async def get_user_course_ids(client: MoodleClient, token: str) -> List[int]:
+    cache_key = f"courses:{cache.url_hash(token)}"
+    
+    cached_ids = await cache.get(cache_key)
+    if cached_ids:
+        return [int(i) for i in cached_ids.split(",")]
+    
+    site_info = await client.get_site_info(token)
+    courses = await client.get_user_courses(token, site_info.get("userid"))
+    course_ids = [course["id"] for course in courses if course.get("id")]
+    
+    if course_ids:
+        await cache.set(cache_key, ",".join(str(i) for i in course_ids), ttl=USER_COURSES_TTL)
+    return course_ids
+
+@router.get("/search", response_model=SearchResponse)
+async def search_content(
+    q: str,
+    course_id: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+    token: str = Depends(get_token),
+    client: MoodleClient = Depends(get_moodle_client)
+):
+    try:
+        course_ids = await get_user_course_ids(client, token)
+        if course_id is not None:
+            course_ids = [c for c in course_ids if c == course_id]
+        
+        results = content_index.search(q, course_ids, limit)
+        return SearchResponse(
+            success=True,
+            results=results
+        )
+    except Exception as e:
+        logger.error(f"Error searching content: {e}")
+        return SearchResponse(
+            success=False,
+            error=str(e)
+        )
+
 @router.post("/batch", response_model=BatchPrefetchResponse)
 async def batch_prefetch(
+    http_request: Request,
     request: BatchPrefetchRequest,
     token: str = Depends(get_token),
     client: MoodleClient = Depends(get_moodle_client)
 ):
+    base_url = public_base_url(http_request)
+    
     async def process_url(url: str) -> BatchPrefetchItem:
-        cache_key = f"activity:{cache.url_hash(url)}"
-        
-        # Check cache
-        cached_content = await cache.get(cache_key)
-        if cached_content:
-            return BatchPrefetchItem(
-                url=url,
-                success=True,
-                content=cached_content
-            )
-            
         try:
-            raw_content = await fetch_activity_content(client, token, url)
-            cleaned_content = clean_html_with_token(raw_content, token)
-            await cache.set(cache_key, cleaned_content)
+            content, _ = await load_activity_content(client, token, url, base_url)
             
             return BatchPrefetchItem(
                 url=url,
                 success=True,
-                content=cleaned_content
+                content=content
             )
         except Exception as e:
             return BatchPrefetchItem(
@@ -164,6 +295,9 @@ async def batch_prefetch(
                 error=str(e)
             )
     
+    # Batch work yields upstream slots to interactive requests
+    upstream_priority.set(Priority.BATCH)
+    
     # Limit concurrency
     semaphore = asyncio.Semaphore(10)
     
@@ -181,7 +315,147 @@ async def batch_prefetch(
         items=items
     )
 
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range "bytes=" header into an inclusive (start, end) pair.
+    Returns None when the header should be ignored (absent, multi-range or malformed).
+    Raises ValueError when the range cannot be satisfied.
+    """
+    if not header:
+        return None
+    
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+    if not match or not any(match.groups()):
+        return None
+    
+    start_str, end_str = match.groups()
+    if not start_str:
+        # Suffix range: last N bytes
+        length = int(end_str)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+    
+    start = int(start_str)
+    end = int(end_str) if end_str else size - 1
+    if start >= size or end < start:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, size - 1)
+
+def iter_file(path: str, start: int, length: int, chunk_size: int = 64 * 1024):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def is_not_modified(request: Request, image: CachedImage) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return if_none_match.strip() == "*" or image.etag in [t.strip() for t in if_none_match.split(",")]
+    
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(image.fetched_at) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+@router.get("/image")
+async def get_image(
+    request: Request,
+    src: str,
+    w: Optional[int] = Query(None, ge=1),
+    g: Optional[str] = None,
+    exp: Optional[str] = None,
+    sig: Optional[str] = None,
+    client: MoodleClient = Depends(get_moodle_client)
+):
+    if not is_moodle_url(src):
+        raise HTTPException(status_code=400, detail="Only Moodle images can be proxied")
+    
+    try:
+        # Cached images are served without asking Moodle, so the signed grant
+        # is the only credential accepted here (browsers can't send headers for <img>)
+        if not (g and exp and sig):
+            raise ImageAuthError("Missing image URL signature")
+        token = await resolve_grant(src, g, exp, sig)
+        
+        image = await image_cache.get_or_fetch(client, token, src, w)
+    except ImageAuthError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    except ImageFetchError as e:
+        logger.warning(f"Image proxy error: {e}")
+        raise HTTPException(status_code=502, detail=str(e))
+    
+    headers = {
+        "ETag": image.etag,
+        "Last-Modified": formatdate(image.fetched_at, usegmt=True),
+        "Cache-Control": "private, max-age=86400",
+        "Accept-Ranges": "bytes",
+    }
+    
+    if is_not_modified(request, image):
+        return Response(status_code=304, headers=headers)
+    
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if not if_range or if_range == image.etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), image.size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{image.size}"})
+    
+    if byte_range is None:
+        headers["Content-Length"] = str(image.size)
+        return StreamingResponse(
+            iter_file(image.path, 0, image.size),
+            media_type=image.content_type,
+            headers=headers
+        )
+    
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{image.size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        iter_file(image.path, start, end - start + 1),
+        status_code=206,
+        media_type=image.content_type,
+        headers=headers
+    )
+
+@router.get("/stats")
+async def get_stats():
+    return {
+        "scheduler": scheduler.stats(),
+        "search_index": content_index.stats()
+    }
+
 @router.delete("/cache")
 async def clear_cache():
     await cache.clear()
+    content_index.clear()
     return {"success": True, "message": "Cache cleared"}
+
+@router.delete("/cache/activity")
+async def invalidate_activity(url: str):
+    cmid = extract_module_id(url)
+    if not cmid:
+        raise HTTPException(status_code=400, detail="Invalid URL: Could not extract module ID")
+    
+    invalidated = await cache.invalidate_tags(f"cmid:{cmid}")
+    # Also covers an entry cached without tags
+    await cache.delete(f"activity:{cache.url_hash(url)}")
+    content_index.remove_activity(cmid)
+    return {"success": True, "invalidated": invalidated}
+
+@router.delete("/cache/course/{course_id}")
+async def invalidate_course(course_id: int):
+    invalidated = await cache.invalidate_tags(f"course:{course_id}")
+    content_index.remove_course(course_id)
+    return {"success": True, "invalidated": invalidated}
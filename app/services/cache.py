@@ -1,40 +1,290 @@
+import asyncio
+import fnmatch
+import json
 import logging
 import time
-from typing import Optional, Any
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Any, Set
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Namespace for keys in the shared tier
+REDIS_PREFIX = "mylms:"
+INVALIDATION_CHANNEL = f"{REDIS_PREFIX}invalidate"
+
+# Tag indexes in the shared tier are sorted sets of keys scored by expiry,
+# pruned on every write. Idle ones expire after this long.
+TAG_PREFIX = f"{REDIS_PREFIX}tagidx:"
+TAG_SET_TTL = 7 * 24 * 3600
+
+# Expired memory entries that are never read again are swept this often
+PURGE_INTERVAL = 60
+
+# Request counts per key, used to warm new workers with the hottest entries
+HOT_KEYS = f"{REDIS_PREFIX}hot"
+HOT_KEYS_MAX = 10000
+HOT_KEYS_TTL = 7 * 24 * 3600
+HIT_FLUSH_INTERVAL = 30
+
 # Simple in-memory cache
 _memory_cache = {}
 
+# Secondary index: tag -> keys, and key -> tags for cleanup
+_tag_index: Dict[str, Set[str]] = {}
+_key_tags: Dict[str, Set[str]] = {}
+
+# Hits not yet flushed to the shared tier
+_hits: Counter = Counter()
+
+_next_purge = 0.0
+
+def content_tags(kind: str, course_id: Optional[int] = None, cmid: Optional[int] = None) -> list:
+    """
+    Standard tags for cached content so it can be invalidated by course or activity
+    """
+    tags = [f"kind:{kind}"]
+    if course_id is not None:
+        tags.append(f"course:{course_id}")
+    if cmid is not None:
+        tags.append(f"cmid:{cmid}")
+    return tags
+
 class CacheService:
     def __init__(self):
-        # We could initialize Redis here if needed
-        # self.redis = redis.Redis(...)
-        pass
+        self.redis = None
+        if settings.REDIS_URL:
+            import redis.asyncio as aioredis
+            self.redis = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
 
-    async def get(self, key: str) -> Optional[str]:
+    async def get(self, key: str, promote: bool = True) -> Optional[str]:
         # Check memory cache
         if key in _memory_cache:
             data, expiry = _memory_cache[key]
             if expiry and time.time() > expiry:
-                del _memory_cache[key]
-                return None
-            return data
-        return None
+                self._forget(key)
+            else:
+                return data
+
+        if self.redis is None:
+            return None
+
+        # Fall back to the shared tier and promote hits into memory
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                data, ttl = await pipe.get(REDIS_PREFIX + key).ttl(REDIS_PREFIX + key).execute()
+        except Exception as e:
+            logger.warning(f"Redis get failed: {e}")
+            return None
+        if data is not None and promote:
+            _memory_cache[key] = (data, time.time() + ttl if ttl and ttl > 0 else None)
+        return data
 
-    async def set(self, key: str, value: str, ttl: int = 3600):
-        expiry = time.time() + ttl if ttl else None
+    async def keys(self, pattern: str) -> List[str]:
+        """
+        List live keys matching a glob pattern, from the shared tier when configured
+        """
+        if self.redis is None:
+            now = time.time()
+            return [
+                key for key, (_, expiry) in list(_memory_cache.items())
+                if fnmatch.fnmatchcase(key, pattern) and not (expiry and now > expiry)
+            ]
+
+        return [
+            key[len(REDIS_PREFIX):]
+            async for key in self.redis.scan_iter(match=REDIS_PREFIX + pattern, count=1000)
+        ]
+
+    async def set(self, key: str, value: str, ttl: int = 3600, tags: Optional[Iterable[str]] = None):
+        now = time.time()
+        self._purge_expired(now)
+        expiry = now + ttl if ttl else None
         _memory_cache[key] = (value, expiry)
-        
+
+        tags = set(tags or [])
+        for tag in tags:
+            _tag_index.setdefault(tag, set()).add(key)
+        if tags:
+            _key_tags.setdefault(key, set()).update(tags)
+
+        if self.redis is None:
+            return
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.set(REDIS_PREFIX + key, value, ex=ttl or None)
+                for tag in tags:
+                    tag_key = TAG_PREFIX + tag
+                    pipe.zadd(tag_key, {key: expiry or float("inf")})
+                    # Drop members whose entries have expired
+                    pipe.zremrangebyscore(tag_key, "-inf", now)
+                    pipe.expire(tag_key, TAG_SET_TTL)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Redis set failed: {e}")
+
     async def delete(self, key: str):
-        if key in _memory_cache:
-            del _memory_cache[key]
-            
+        await self.delete_many([key])
+
+    async def delete_many(self, keys: Iterable[str]):
+        keys = list(keys)
+        for key in keys:
+            self._forget(key)
+
+        if self.redis is None or not keys:
+            return
+
+        try:
+            await self.redis.delete(*[REDIS_PREFIX + key for key in keys])
+            # Drop the keys from other workers' memory caches too
+            await self.redis.publish(INVALIDATION_CHANNEL, json.dumps(keys))
+        except Exception as e:
+            logger.warning(f"Redis delete failed: {e}")
+
+    async def invalidate_tags(self, *tags: str) -> int:
+        """
+        Delete every entry carrying any of the given tags. Returns the number of keys removed.
+        """
+        keys = set()
+        for tag in tags:
+            keys |= _tag_index.pop(tag, set())
+
+        if self.redis is not None:
+            tag_keys = [TAG_PREFIX + tag for tag in tags]
+            try:
+                for tag_key in tag_keys:
+                    keys |= set(await self.redis.zrange(tag_key, 0, -1))
+                await self.redis.delete(*tag_keys)
+            except Exception as e:
+                logger.warning(f"Redis tag lookup failed: {e}")
+
+        await self.delete_many(keys)
+        logger.info(f"Invalidated {len(keys)} cache entries for tags {list(tags)}")
+        return len(keys)
+
     async def clear(self):
         _memory_cache.clear()
-        
+        _tag_index.clear()
+        _key_tags.clear()
+
+        if self.redis is None:
+            return
+
+        try:
+            keys = [key async for key in self.redis.scan_iter(match=f"{REDIS_PREFIX}*")]
+            if keys:
+                await self.redis.delete(*keys)
+            await self.redis.publish(INVALIDATION_CHANNEL, json.dumps("*"))
+        except Exception as e:
+            logger.warning(f"Redis clear failed: {e}")
+
+    async def listen_invalidations(self):
+        """
+        Apply invalidations published by other workers to this worker's memory cache
+        """
+        if self.redis is None:
+            return
+
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(INVALIDATION_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message.get("type") != "message":
+                            continue
+                        keys = json.loads(message["data"])
+                        if keys == "*":
+                            _memory_cache.clear()
+                            _tag_index.clear()
+                            _key_tags.clear()
+                        else:
+                            for key in keys:
+                                self._forget(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cache invalidation listener error: {e}")
+                await asyncio.sleep(1)
+
+    def track(self, key: str):
+        """
+        Count a request for a key so the hottest keys can be warmed on boot
+        """
+        if self.redis is not None:
+            _hits[key] += 1
+
+    async def flush_hits(self):
+        """
+        Periodically push hit counts to the shared tier
+        """
+        if self.redis is None:
+            return
+
+        while True:
+            await asyncio.sleep(HIT_FLUSH_INTERVAL)
+            if not _hits:
+                continue
+            hits = dict(_hits)
+            _hits.clear()
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for key, count in hits.items():
+                        pipe.zincrby(HOT_KEYS, count, key)
+                    # Keep only the most requested keys
+                    pipe.zremrangebyrank(HOT_KEYS, 0, -HOT_KEYS_MAX - 1)
+                    pipe.expire(HOT_KEYS, HOT_KEYS_TTL)
+                    await pipe.execute()
+            except Exception as e:
+                logger.warning(f"Failed to flush cache hits: {e}")
+
+    async def warm(self, count: int) -> int:
+        """
+        Load the most requested entries from the shared tier into memory.
+        Returns the number of entries loaded.
+        """
+        if self.redis is None or count <= 0:
+            return 0
+
+        keys = await self.redis.zrevrange(HOT_KEYS, 0, count - 1)
+        if not keys:
+            return 0
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.get(REDIS_PREFIX + key)
+                pipe.ttl(REDIS_PREFIX + key)
+            results = await pipe.execute()
+
+        now = time.time()
+        warmed = 0
+        for key, data, ttl in zip(keys, results[::2], results[1::2]):
+            if data is None:
+                continue
+            _memory_cache[key] = (data, now + ttl if ttl and ttl > 0 else None)
+            warmed += 1
+        return warmed
+
+    @staticmethod
+    def _purge_expired(now: float):
+        global _next_purge
+        if now < _next_purge:
+            return
+        _next_purge = now + PURGE_INTERVAL
+        for key, (_, expiry) in list(_memory_cache.items()):
+            if expiry and now > expiry:
+                CacheService._forget(key)
+
+    @staticmethod
+    def _forget(key: str):
+        _memory_cache.pop(key, None)
+        for tag in _key_tags.pop(key, set()):
+            keys = _tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del _tag_index[tag]
+
     @staticmethod
     def url_hash(url: str) -> str:
         import hashlib
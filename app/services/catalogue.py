@@ -0,0 +1,257 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ["md5", "title", "author", "year", "publisher", "isbn", "extension", "filesize", "download_url"]
+
+# Alternative column names seen in catalogue dumps
+COLUMN_ALIASES = {
+    "authors": "author",
+    "identifier": "isbn",
+    "isbns": "isbn",
+    "ext": "extension",
+    "size": "filesize",
+    "url": "download_url",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY,
+    md5 TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL DEFAULT '',
+    author TEXT NOT NULL DEFAULT '',
+    year TEXT NOT NULL DEFAULT '',
+    publisher TEXT NOT NULL DEFAULT '',
+    isbn TEXT NOT NULL DEFAULT '',
+    extension TEXT NOT NULL DEFAULT '',
+    filesize INTEGER,
+    download_url TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+    title, author, publisher, isbn,
+    content='books', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3'
+);
+"""
+
+# Default FTS5 rank: bm25 with column weights for title, author, publisher, isbn
+RANK = "bm25(10.0, 5.0, 1.0, 2.0)"
+
+HOT_QUERY_CACHE_SIZE = 512
+# Totals above this are reported as a lower bound ("total_exact": false)
+MAX_COUNTED_MATCHES = 1000
+IMPORT_BATCH_SIZE = 5000
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+class CatalogueUnavailable(Exception):
+    pass
+
+def _normalize_row(row: Dict[str, Any]) -> Optional[Tuple]:
+    record = {}
+    for key, value in row.items():
+        if key is None:
+            continue
+        key = key.strip().lower()
+        record[COLUMN_ALIASES.get(key, key)] = value
+
+    md5 = str(record.get("md5") or "").strip().lower()
+    if not md5:
+        return None
+
+    try:
+        filesize = int(record.get("filesize") or 0) or None
+    except ValueError:
+        filesize = None
+
+    return (
+        md5,
+        str(record.get("title") or "").strip(),
+        str(record.get("author") or "").strip(),
+        str(record.get("year") or "").strip(),
+        str(record.get("publisher") or "").strip(),
+        str(record.get("isbn") or "").strip(),
+        str(record.get("extension") or "").strip().lower(),
+        filesize,
+        record.get("download_url") or None,
+    )
+
+def _read_dump(path: str) -> Iterator[Dict[str, Any]]:
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+        return
+
+    with open(path, encoding="utf-8") as f:
+        first = f.read(1)
+        while first and first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == "[":
+            yield from json.load(f)
+        else:
+            # JSON lines
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def _batched(rows: Iterable[Tuple], size: int) -> Iterator[List[Tuple]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def import_catalogue(dump_path: str, db_path: str) -> int:
+    """
+    Build the catalogue index from a CSV, JSON or JSON-lines dump.
+    The index is built next to the target and swapped in atomically.
+    """
+    tmp_path = f"{db_path}.building"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    count = 0
+    try:
+        conn.executescript("PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF;")
+        conn.executescript(SCHEMA)
+
+        rows = (r for r in map(_normalize_row, _read_dump(dump_path)) if r)
+        for batch in _batched(rows, IMPORT_BATCH_SIZE):
+            conn.executemany(
+                f"INSERT OR REPLACE INTO books ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                batch,
+            )
+            count += len(batch)
+
+        conn.execute("INSERT INTO books_fts(books_fts) VALUES('rebuild')")
+        conn.execute("INSERT INTO books_fts(books_fts, rank) VALUES('rank', ?)", (RANK,))
+        conn.execute("INSERT INTO books_fts(books_fts) VALUES('optimize')")
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, db_path)
+    logger.info(f"Imported {count} catalogue entries into {db_path}")
+    return count
+
+def build_match_query(query: str) -> Optional[str]:
+    """
+    Turn free text into an FTS5 query where every term is prefix-matched
+    """
+    tokens = TOKEN_RE.findall(query.lower())
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens)
+
+class Catalogue:
+    """
+    Read-only view over the local catalogue index with an LRU of hot queries.
+    Each thread gets its own SQLite connection, so searches run in parallel.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._mtime: Optional[float] = None
+        self._hot_lock = threading.Lock()
+        self._hot: "OrderedDict[Tuple[str, int, int], Dict[str, Any]]" = OrderedDict()
+
+    def _connection(self) -> sqlite3.Connection:
+        try:
+            mtime = os.path.getmtime(self.db_path)
+        except OSError:
+            raise CatalogueUnavailable("Catalogue index not found (run the catalogue importer)")
+
+        # A re-import swapped the file: drop results from the old index
+        if mtime != self._mtime:
+            with self._hot_lock:
+                self._hot.clear()
+                self._mtime = mtime
+
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.mtime != mtime:
+            if conn is not None:
+                conn.close()
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.mtime = mtime
+        return conn
+
+    def search(self, query: str, page: int = 1, limit: int = 20) -> Dict[str, Any]:
+        match = build_match_query(query)
+        if not match:
+            return {"query": query, "books": [], "total": 0, "total_exact": True, "page": page, "limit": limit}
+
+        key = (match, page, limit)
+        conn = self._connection()
+        with self._hot_lock:
+            if key in self._hot:
+                self._hot.move_to_end(key)
+                # Different raw queries can share a match expression
+                return {**self._hot[key], "query": query}
+
+        # Counting every match of a broad prefix is O(matches), so stop early
+        total = conn.execute(
+            "SELECT count(*) FROM (SELECT 1 FROM books_fts WHERE books_fts MATCH ? LIMIT ?)",
+            (match, MAX_COUNTED_MATCHES + 1),
+        ).fetchone()[0]
+
+        # Ranking covers every match; FTS5 keeps only the top LIMIT + OFFSET rows
+        rows = conn.execute(
+            """
+            SELECT b.md5, b.title, b.author, b.year, b.publisher, b.isbn, b.extension, b.filesize
+            FROM (
+                SELECT rowid, rank FROM books_fts WHERE books_fts MATCH ?
+                ORDER BY rank LIMIT ? OFFSET ?
+            ) r
+            JOIN books b ON b.id = r.rowid
+            ORDER BY r.rank
+            """,
+            (match, limit, (page - 1) * limit),
+        ).fetchall()
+
+        result = {
+            "query": query,
+            "books": [dict(row) for row in rows],
+            "total": min(total, MAX_COUNTED_MATCHES),
+            "total_exact": total <= MAX_COUNTED_MATCHES,
+            "page": page,
+            "limit": limit,
+        }
+        with self._hot_lock:
+            self._hot[key] = result
+            while len(self._hot) > HOT_QUERY_CACHE_SIZE:
+                self._hot.popitem(last=False)
+        return result
+
+    def get_book(self, md5: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute("SELECT * FROM books WHERE md5 = ?", (md5.lower(),)).fetchone()
+        return dict(row) if row else None
+
+# Singleton instance
+catalogue = Catalogue(settings.CATALOGUE_DB_PATH)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build the local book catalogue index")
+    parser.add_argument("dump", help="CSV, JSON or JSON-lines catalogue dump")
+    parser.add_argument("--db", default=settings.CATALOGUE_DB_PATH, help="Index path")
+    args = parser.parse_args()
+    import_catalogue(args.dump, args.db)
@@ -2,6 +2,9 @@ import re
 import logging
 from bs4 import BeautifulSoup, Comment
 from typing import Optional, List
+from urllib.parse import urljoin
+from app.config import settings
+from app.services.images import is_moodle_url, proxy_url, strip_token
 
 logger = logging.getLogger(__name__)
 
@@ -45,7 +48,7 @@ UNWANTED_SELECTORS = [
 def clean_html_content(html: str) -> str:
     return clean_html_with_token(html, None)
 
-def clean_html_with_token(html: str, token: Optional[str] = None) -> str:
+def clean_html_with_token(html: str, token: Optional[str] = None, base_url: Optional[str] = None) -> str:
     if not html:
         return ""
     
@@ -72,7 +75,7 @@ def clean_html_with_token(html: str, token: Optional[str] = None) -> str:
     
     # 6. Fix image URLs
     if token:
-        fix_image_urls(soup, token)
+        fix_image_urls(soup, base_url)
         
     # Get string
     output = str(soup)
@@ -137,22 +140,23 @@ def remove_empty_paragraphs(soup: BeautifulSoup):
             if not p.find_all(["img", "video", "audio", "iframe"]):
                 p.decompose()
 
-def fix_image_urls(soup: BeautifulSoup, token: str):
+def fix_image_urls(soup: BeautifulSoup, base_url: Optional[str] = None):
     for img in soup.find_all("img"):
         src = img.get("src")
         if not src:
             continue
             
-        if "token=" in src:
-            continue
-            
         if src.startswith("data:"):
             continue
             
-        if src.startswith("http") and "mylms.vossie.net" not in src:
+        # Relative srcs resolve against the file they came from
+        if base_url:
+            src = urljoin(base_url, src)
+        elif src.startswith("/"):
+            src = urljoin(f"{settings.MOODLE_URL}/", src)
+            
+        if not is_moodle_url(src):
             continue
             
-        # Add token
-        separator = "&" if "?" in src else "?"
-        new_src = f"{src}{separator}token={token}"
-        img["src"] = new_src
+        # Point at the image proxy; the token stays server-side
+        img["src"] = proxy_url(strip_token(src))
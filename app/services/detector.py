@@ -0,0 +1,197 @@
+import asyncio
+import html as html_lib
+import json
+import logging
+import re
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+from app.services.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# How far past a "Prescribed Reading" heading to look for citations
+PRESCRIBED_BLOCK_CHARS = 1500
+PRESCRIBED_MAX_LINES = 12
+
+# Detection results are small; keep them around longer than page content
+DETECTION_TTL = 24 * 3600
+
+# Results for HTML posted by clients stay in a bounded per-worker LRU
+RECENT_DETECTIONS_SIZE = 256
+
+SCRIPT_STYLE_RE = re.compile(r"<(script|style)\b.*?</\1\s*>", re.I | re.S)
+BLOCK_TAG_RE = re.compile(r"<\s*(?:br|/?p|/?div|/?li|/?ul|/?ol|/?tr|/?td|/?h[1-6]|/?blockquote)\b[^>]*>", re.I)
+TAG_RE = re.compile(r"<[^>]*>")
+
+# One alternation so a single left-to-right pass finds every kind of reference
+DETECT_RE = re.compile(
+    r"""
+      (?:\bISBN(?:-1[03])?\s*:?\s*(?P<isbn>(?:\d[\s-]?){9,12}[\dXx]))
+    | (?P<isbn13>\b97[89](?:[\s-]?\d){10}\b)
+    | (?P<doi>\b10\.\d{4,9}/[-._;()/:A-Za-z0-9]+)
+    | (?P<prescribed>\bPrescribed\s+Readings?\b)
+    """,
+    re.I | re.X,
+)
+
+APA_RE = re.compile(r"^(?P<author>[^()]{2,200}?)\s*\((?P<year>\d{4})[a-z]?\)\.?\s*(?P<title>[^.]{3,300})")
+BY_RE = re.compile(r"^(?P<title>.{3,300}?)\s+by\s+(?P<author>[^,(;]{2,200})", re.I)
+
+# An author is a run of capitalised names or initials, e.g. "R. C. Martin"
+NAME_TOKEN_RE = re.compile(r"^(?:[A-Z][a-zA-Z'’-]+|(?:[A-Z]\.)+)$")
+NAME_CONNECTORS = {"and", "&", "et", "al.", "van", "von", "de", "der", "den", "du", "da", "di", "le", "la"}
+DATE_WORDS = {
+    "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday",
+    "january", "february", "march", "april", "may", "june", "july", "august",
+    "september", "october", "november", "december",
+    "today", "tomorrow", "tonight", "noon", "midnight", "week", "month", "end",
+}
+
+def html_to_text(html: str) -> str:
+    text = SCRIPT_STYLE_RE.sub(" ", html)
+    text = BLOCK_TAG_RE.sub("\n", text)
+    text = TAG_RE.sub(" ", text)
+    return html_lib.unescape(text).replace("\xa0", " ")
+
+def is_valid_isbn10(digits: str) -> bool:
+    if len(digits) != 10 or not digits[:9].isdigit() or not (digits[9].isdigit() or digits[9] == "X"):
+        return False
+    check = 10 if digits[9] == "X" else int(digits[9])
+    total = sum((10 - i) * int(d) for i, d in enumerate(digits[:9])) + check
+    return total % 11 == 0
+
+def is_valid_isbn13(digits: str) -> bool:
+    if len(digits) != 13 or not digits.isdigit():
+        return False
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits))
+    return total % 10 == 0
+
+def isbn10_to_13(isbn10: str) -> str:
+    body = "978" + isbn10[:9]
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(body))
+    return body + str((10 - total % 10) % 10)
+
+def normalize_isbn(raw: str) -> Optional[str]:
+    """
+    Return the ISBN-13 form of a raw match, or None if no checksum validates.
+    Greedy matches may run into neighbouring digits, so try the longest valid prefix.
+    """
+    digits = re.sub(r"[\s-]", "", raw).upper()
+    if len(digits) >= 13 and is_valid_isbn13(digits[:13]):
+        return digits[:13]
+    if len(digits) >= 10 and is_valid_isbn10(digits[:10]):
+        return isbn10_to_13(digits[:10])
+    return None
+
+def is_plausible_author(author: str) -> bool:
+    tokens = author.replace(",", " ").split()
+    if any(t.lower().strip(".") in DATE_WORDS for t in tokens):
+        return False
+    names = [t for t in tokens if t.lower() not in NAME_CONNECTORS]
+    return 2 <= len(names) <= 12 and all(NAME_TOKEN_RE.match(t) for t in names)
+
+def parse_citation(line: str) -> Optional[Dict[str, str]]:
+    match = APA_RE.match(line)
+    if match and is_plausible_author(match.group("author")):
+        return {
+            "type": "citation",
+            "title": match.group("title").strip(),
+            "author": match.group("author").strip().rstrip(","),
+            "year": match.group("year"),
+        }
+
+    match = BY_RE.match(line)
+    if match and is_plausible_author(match.group("author").strip().rstrip(".")):
+        return {
+            "type": "citation",
+            "title": match.group("title").strip().strip("\"'"),
+            "author": match.group("author").strip().rstrip("."),
+        }
+    return None
+
+def parse_prescribed_block(text: str, start: int) -> List[Dict[str, str]]:
+    block = text[start:start + PRESCRIBED_BLOCK_CHARS]
+    books = []
+    lines = [line.strip(" \t:-*•") for line in block.split("\n")]
+    for line in [line for line in lines if line][:PRESCRIBED_MAX_LINES]:
+        citation = parse_citation(re.sub(r"\s+", " ", line))
+        if citation:
+            books.append(citation)
+    return books
+
+def book_key(book: Dict[str, str]) -> tuple:
+    return book["type"], book.get("isbn") or book.get("doi") or book.get("title", "").lower()
+
+def detect_books(html: str) -> List[Dict[str, str]]:
+    """
+    Detect book references (ISBNs, DOIs and prescribed reading citations) in HTML
+    """
+    if not html:
+        return []
+
+    text = html_to_text(html)
+    books = []
+    seen = set()
+
+    def add(book: Dict[str, str]):
+        key = book_key(book)
+        if key not in seen:
+            seen.add(key)
+            books.append(book)
+
+    for match in DETECT_RE.finditer(text):
+        kind = match.lastgroup
+        value = match.group(kind)
+
+        if kind in ("isbn", "isbn13"):
+            isbn = normalize_isbn(value)
+            if isbn:
+                add({"type": "isbn", "isbn": isbn})
+        elif kind == "doi":
+            add({"type": "doi", "doi": value.rstrip(".,;:)")})
+        elif kind == "prescribed":
+            for citation in parse_prescribed_block(text, match.end()):
+                add(citation)
+
+    return books
+
+def merge_books(book_lists: Iterable[List[Dict[str, str]]]) -> List[Dict[str, str]]:
+    books = []
+    seen = set()
+    for book in (book for books in book_lists for book in books):
+        key = book_key(book)
+        if key not in seen:
+            seen.add(key)
+            books.append(book)
+    return books
+
+_recent_detections: "OrderedDict[str, List[Dict[str, str]]]" = OrderedDict()
+
+async def detect_books_cached(html: str) -> List[Dict[str, str]]:
+    key = cache.url_hash(html)
+    books = _recent_detections.get(key)
+    if books is None:
+        books = await asyncio.to_thread(detect_books, html)
+        _recent_detections[key] = books
+        while len(_recent_detections) > RECENT_DETECTIONS_SIZE:
+            _recent_detections.popitem(last=False)
+    else:
+        _recent_detections.move_to_end(key)
+    return books
+
+def activity_detection_key(url: str) -> str:
+    return f"books:activity:{cache.url_hash(url)}"
+
+async def get_activity_detection(url: str) -> Optional[List[Dict[str, str]]]:
+    cached = await cache.get(activity_detection_key(url))
+    if cached:
+        return json.loads(cached)
+    return None
+
+async def store_activity_detection(url: str, books: List[Dict[str, str]], tags: Optional[List[str]] = None):
+    """
+    Store detection results for an activity, computed on its raw files while
+    caching its content. Served content is cleaned and signed, so it can't be
+    matched back to these results; look them up by activity URL instead.
+    """
+    await cache.set(activity_detection_key(url), json.dumps(books), ttl=DETECTION_TTL, tags=tags)
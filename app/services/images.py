@@ -0,0 +1,302 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import secrets
+import time
+import urllib.parse
+from dataclasses import dataclass
+from typing import Dict, Optional
+from app.config import settings
+from app.services.cache import cache
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, images are served at full size without it
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PARAMS = ("token", "wstoken")
+
+CHUNK_SIZE = 64 * 1024
+
+# Requested widths are rounded up to one of these, so each image has few variants
+IMAGE_WIDTHS = (320, 640, 960, 1280, 1600)
+
+PROXY_PATH = "/api/content/image"
+# Cached content stores proxy URLs without an origin; it is added when serving.
+# Older entries may carry an absolute origin, which is replaced.
+PROXY_SRC_RE = re.compile(r"(?<=[\"'])(?:https?://[^\"'/\s]+)?" + re.escape(f"{PROXY_PATH}?src=") + r"([^\"'&\s]+)")
+
+if settings.IMAGE_PROXY_SECRET:
+    _secret = settings.IMAGE_PROXY_SECRET.encode()
+else:
+    # Shared by preforked workers, but signed URLs stop verifying after a restart
+    logger.warning("IMAGE_PROXY_SECRET not set, using a random per-process secret")
+    _secret = secrets.token_bytes(32)
+
+class ImageFetchError(Exception):
+    pass
+
+class ImageAuthError(ImageFetchError):
+    pass
+
+@dataclass
+class CachedImage:
+    path: str
+    size: int
+    content_type: str
+    etag: str
+    fetched_at: float
+
+def strip_token(url: str) -> str:
+    parts = urllib.parse.urlsplit(url)
+    query = [
+        (k, v) for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in TOKEN_PARAMS
+    ]
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
+def is_moodle_url(url: str) -> bool:
+    moodle_host = urllib.parse.urlsplit(settings.MOODLE_URL).netloc
+    return urllib.parse.urlsplit(url).netloc == moodle_host
+
+def variant_width(width: int) -> int:
+    for candidate in IMAGE_WIDTHS:
+        if candidate >= width:
+            return min(candidate, settings.IMAGE_MAX_WIDTH)
+    return settings.IMAGE_MAX_WIDTH
+
+def proxy_url(url: str) -> str:
+    """
+    Build the proxy path for a (token-free) Moodle image URL
+    """
+    return f"{PROXY_PATH}?src={urllib.parse.quote(url, safe='')}"
+
+def _sign(*parts: str) -> str:
+    return hmac.new(_secret, "|".join(parts).encode(), hashlib.sha256).hexdigest()[:32]
+
+def grant_key(grant: str) -> str:
+    return f"imggrant:{grant}"
+
+async def sign_image_urls(html: str, token: str, base_url: str) -> str:
+    """
+    Make every proxy URL in served content absolute (against base_url, so
+    frontends on other origins load them from this server) and append a
+    signed, expiring grant. The grant resolves to the token through the cache
+    tier, so browsers can load images without credentials and the token never
+    appears in a URL.
+    """
+    if PROXY_PATH not in html:
+        return html
+
+    now = int(time.time())
+    # Round expiry up to the hour so URLs stay stable for browser caches
+    expires = str((now // 3600 + 1) * 3600 + settings.IMAGE_URL_TTL)
+    grant = _sign("grant", token)
+    await cache.set(grant_key(grant), token, ttl=int(expires) - now)
+
+    def add_grant(match: re.Match) -> str:
+        sig = _sign(urllib.parse.unquote(match.group(1)), grant, expires)
+        return f"{base_url}{PROXY_PATH}?src={match.group(1)}&amp;g={grant}&amp;exp={expires}&amp;sig={sig}"
+
+    return PROXY_SRC_RE.sub(add_grant, html)
+
+async def resolve_grant(src: str, grant: str, expires: str, sig: str) -> Optional[str]:
+    """
+    Return the token behind a signed proxy URL. Raises ImageAuthError if the
+    signature is invalid or expired; returns None if the grant is gone.
+    """
+    if not expires.isdigit() or int(expires) < time.time():
+        raise ImageAuthError("Image URL expired")
+    if not hmac.compare_digest(sig, _sign(src, grant, expires)):
+        raise ImageAuthError("Invalid image URL signature")
+    return await cache.get(grant_key(grant))
+
+class ImageCache:
+    """
+    Disk cache for proxied Moodle images, keyed by the token-free URL.
+    Total size is bounded by evicting least recently used files.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._total_bytes: Optional[int] = None
+
+    @staticmethod
+    def key_for(url: str) -> str:
+        return hashlib.sha256(strip_token(url).encode()).hexdigest()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name[:2], name)
+
+    def _load(self, name: str) -> Optional[CachedImage]:
+        path = self._path(name)
+        try:
+            with open(f"{path}.json") as f:
+                meta = json.load(f)
+            size = os.path.getsize(path)
+            # mtime tracks last access for LRU eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return CachedImage(
+            path=path,
+            size=size,
+            content_type=meta["content_type"],
+            etag=meta["etag"],
+            fetched_at=meta["fetched_at"],
+        )
+
+    def _store_meta(self, name: str, content_type: str, etag: str):
+        with open(f"{self._path(name)}.json", "w") as f:
+            json.dump({"content_type": content_type, "etag": etag, "fetched_at": time.time()}, f)
+
+    async def get_or_fetch(self, client, token: Optional[str], url: str, width: Optional[int] = None) -> CachedImage:
+        key = self.key_for(url)
+
+        original = self._load(key)
+        if original is None:
+            async with self._lock(key):
+                original = self._load(key)
+                if original is None:
+                    if not token:
+                        raise ImageAuthError("No token available to fetch image")
+                    original = await self._fetch(client, token, strip_token(url), key)
+            self._unlock(key)
+
+        if not width or Image is None:
+            return original
+
+        width = variant_width(width)
+        variant = f"{key}-w{width}"
+        resized = self._load(variant)
+        if resized is None:
+            async with self._lock(variant):
+                resized = self._load(variant)
+                if resized is None:
+                    resized = await asyncio.to_thread(self._resize, original, variant, width)
+                    if resized is not None:
+                        await self._account(resized.size)
+            self._unlock(variant)
+        return resized or original
+
+    def _lock(self, name: str) -> asyncio.Lock:
+        return self._locks.setdefault(name, asyncio.Lock())
+
+    def _unlock(self, name: str):
+        lock = self._locks.get(name)
+        if lock is not None and not lock.locked():
+            del self._locks[name]
+
+    async def _fetch(self, client, token: str, url: str, key: str) -> CachedImage:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        digest = hashlib.md5()
+        size = 0
+
+        try:
+            async with client.stream_file(token, url) as response:
+                if response.status_code != 200:
+                    raise ImageFetchError(f"Upstream returned {response.status_code}")
+                content_type = response.headers.get("content-type", "").split(";")[0]
+                # Moodle answers failed pluginfile requests with an HTML page
+                if not content_type.startswith("image/"):
+                    raise ImageFetchError(f"Upstream returned non-image content: {content_type}")
+                with open(tmp_path, "wb") as f:
+                    async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+        except ImageFetchError:
+            self._discard(tmp_path)
+            raise
+        except Exception as e:
+            self._discard(tmp_path)
+            logger.error(f"Failed to fetch image: {e}")
+            raise ImageFetchError(f"Failed to fetch image: {e}")
+
+        os.replace(tmp_path, path)
+        etag = f'"{digest.hexdigest()}"'
+        self._store_meta(key, content_type, etag)
+        await self._account(size)
+
+        logger.debug(f"Cached image {key} ({size} bytes)")
+        return CachedImage(path=path, size=size, content_type=content_type, etag=etag, fetched_at=time.time())
+
+    def _resize(self, original: CachedImage, variant: str, width: int) -> Optional[CachedImage]:
+        try:
+            with Image.open(original.path) as img:
+                if img.width <= width:
+                    return None
+                fmt = img.format
+                height = round(img.height * width / img.width)
+                resized = img.resize((width, height))
+                path = self._path(variant)
+                # Write aside and swap in, as an older copy may still be streaming
+                resized.save(f"{path}.tmp", format=fmt)
+            os.replace(f"{path}.tmp", path)
+        except Exception as e:
+            logger.warning(f"Failed to resize image {original.path}: {e}")
+            self._discard(f"{self._path(variant)}.tmp")
+            return None
+
+        etag = f'{original.etag[:-1]}-w{width}"'
+        self._store_meta(variant, original.content_type, etag)
+        size = os.path.getsize(path)
+        return CachedImage(path=path, size=size, content_type=original.content_type, etag=etag, fetched_at=time.time())
+
+    @staticmethod
+    def _discard(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _scan(self):
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith((".json", ".tmp")):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    async def _account(self, size: int):
+        if self._total_bytes is None:
+            files = await asyncio.to_thread(self._scan)
+            self._total_bytes = sum(f[1] for f in files)
+        else:
+            self._total_bytes += size
+
+        if self._total_bytes > self.max_bytes:
+            await asyncio.to_thread(self._evict)
+
+    def _evict(self):
+        files = sorted(self._scan())
+        total = sum(f[1] for f in files)
+        # Evict down to 90% so we don't rescan on every insert
+        target = self.max_bytes * 0.9
+        for _, size, path in files:
+            if total <= target:
+                break
+            self._discard(path)
+            self._discard(f"{path}.json")
+            total -= size
+        self._total_bytes = total
+        logger.info(f"Evicted images, cache now {total} bytes")
+
+# Singleton instance
+image_cache = ImageCache(settings.IMAGE_CACHE_DIR, settings.IMAGE_CACHE_MAX_BYTES)
@@ -1,7 +1,11 @@
+import asyncio
 import httpx
 import logging
 import urllib.parse
 from typing import Dict, Any, List, Optional
+from app.config import settings
+from app.services.catalogue import CatalogueUnavailable, catalogue
+from app.services.detector import detect_books_cached, get_activity_detection
 
 logger = logging.getLogger(__name__)
 
@@ -12,33 +16,52 @@ class LibGenClient:
     async def close(self):
         await self.client.aclose()
         
-    async def search(self, query: str) -> Dict[str, Any]:
+    async def search(self, query: str, page: int = 1, limit: int = 20) -> Dict[str, Any]:
         """
-        Search for books on LibGen.
-        Currently a placeholder as per original Rust implementation.
+        Search for books in the local catalogue index.
         """
-        logger.info(f"Searching LibGen for: {query}")
+        logger.info(f"Searching catalogue for: {query}")
         
-        # Original Rust implementation had this as a TODO
-        # We'll mimic that behavior but return an empty result structure
-        
-        return {
-            "query": query,
-            "books": [],
-            "total": 0,
-            "error": "Search not implemented (requires mirror configuration)"
-        }
+        try:
+            return await asyncio.to_thread(catalogue.search, query, page, limit)
+        except CatalogueUnavailable as e:
+            return {
+                "query": query,
+                "books": [],
+                "total": 0,
+                "error": str(e)
+            }
         
     async def get_download_url(self, md5: str) -> str:
         """
         Get download URL for a book by MD5
         """
         logger.info(f"Getting download URL for MD5: {md5}")
-        return f"https://libgen.is/get.php?md5={md5}"
         
-    async def detect_books_from_html(self, html: str) -> List[Dict[str, str]]:
+        try:
+            book = await asyncio.to_thread(catalogue.get_book, md5)
+        except CatalogueUnavailable:
+            return settings.CATALOGUE_DOWNLOAD_URL.format(md5=md5)
+        
+        # Partial catalogues: unknown books still resolve through the mirror
+        if not book or not book.get("download_url"):
+            return settings.CATALOGUE_DOWNLOAD_URL.format(md5=md5)
+        
+        return book["download_url"]
+        
+    async def detect_books_from_html(self, html: str, url: Optional[str] = None) -> List[Dict[str, str]]:
+        """
+        Detect prescribed books from HTML content. Given the activity URL,
+        results computed when the activity was cached are returned instead.
+        """
+        if url:
+            books = await get_activity_detection(url)
+            if books is not None:
+                return books
+        return await detect_books_cached(html)
+
+    async def detect_books_batch(self, documents: List[str]) -> List[List[Dict[str, str]]]:
         """
-        Detect prescribed books from HTML content
+        Detect prescribed books from many HTML documents
         """
-        # Placeholder logic
-        return []
+        return list(await asyncio.gather(*[detect_books_cached(html) for html in documents]))
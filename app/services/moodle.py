@@ -1,8 +1,10 @@
 import httpx
 import logging
 import json
+from contextlib import asynccontextmanager
 from typing import Dict, Any, List, Optional
 from app.config import settings
+from app.services.scheduler import scheduler
 
 logger = logging.getLogger(__name__)
 
@@ -30,7 +32,7 @@ class MoodleClient:
         logger.debug(f"Moodle API call: {wsfunction}")
         
         try:
-            response = await self.client.post(self.webservice_url, data=data)
+            response = await scheduler.run(token, lambda: self.client.post(self.webservice_url, data=data))
             response.raise_for_status()
             
             result = response.json()
@@ -61,15 +63,30 @@ class MoodleClient:
     async def get_course_module(self, token: str, cmid: int) -> Dict[str, Any]:
         return await self.call(token, "core_course_get_course_module", cmid=cmid)
     
-    async def download_file(self, token: str, file_url: str) -> Optional[str]:
-        # Handle token in URL
+    @staticmethod
+    def _with_token(file_url: str, token: str) -> str:
         url = file_url
         if "token=" not in url and "wstoken=" not in url:
             separator = "&" if "?" in url else "?"
             url = f"{url}{separator}token={token}"
+        return url
+
+    @asynccontextmanager
+    async def stream_file(self, token: str, file_url: str):
+        """
+        Open a streaming GET for a file, for use as an async context manager.
+        Holds an upstream scheduler slot until the stream is closed.
+        """
+        async with scheduler.slot(token):
+            async with self.client.stream("GET", self._with_token(file_url, token)) as response:
+                yield response
+
+    async def download_file(self, token: str, file_url: str) -> Optional[str]:
+        # Handle token in URL
+        url = self._with_token(file_url, token)
             
         try:
-            response = await self.client.get(url)
+            response = await scheduler.run(token, lambda: self.client.get(url))
             response.raise_for_status()
             
             # Check for error in content (Moodle returns 200 OK even for some errors with JSON body)
@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BATCH = 1
+
+# Priority of upstream work started from the current request; routers set this
+upstream_priority: ContextVar[Priority] = ContextVar("upstream_priority", default=Priority.INTERACTIVE)
+
+def user_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
+
+class UpstreamScheduler:
+    """
+    Fair scheduler for upstream Moodle work. Waiters are queued per user and
+    priority; free slots go to the highest priority with waiters, round-robin
+    across users, subject to a per-user in-flight cap.
+
+    State is per process, so the configured limits are for the whole
+    deployment and each worker takes its share (see set_workers); a user's
+    requests spread over several workers are capped by the sum of the shares.
+    A worker's per-user share never drops below min_per_user, so one request's
+    parallel downloads aren't serialised.
+    """
+
+    def __init__(self, max_concurrency: int, per_user_limit: int, min_per_user: int = 1):
+        self.total_concurrency = max_concurrency
+        self.total_per_user_limit = per_user_limit
+        self.min_per_user = max(min_per_user, 1)
+        self.set_workers(1)
+        self._active = 0
+        self._in_flight: Dict[str, int] = {}
+        # priority -> user -> waiters; dict order is the round-robin order
+        self._queues: Dict[Priority, "OrderedDict[str, Deque[asyncio.Future]]"] = {
+            priority: OrderedDict() for priority in Priority
+        }
+
+    def set_workers(self, workers: int):
+        """
+        Split the deployment-wide limits evenly across worker processes
+        """
+        workers = max(workers, 1)
+        self.per_user_limit = max(self.total_per_user_limit // workers, self.min_per_user)
+        self.max_concurrency = max(self.total_concurrency // workers, self.per_user_limit)
+
+    @asynccontextmanager
+    async def slot(self, token: str) -> AsyncIterator[None]:
+        user = user_key(token)
+        await self._acquire(user, upstream_priority.get())
+        try:
+            yield
+        finally:
+            self._release(user)
+
+    async def run(self, token: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        async with self.slot(token):
+            return await fn()
+
+    def _can_start(self, user: str) -> bool:
+        return self._active < self.max_concurrency and self._in_flight.get(user, 0) < self.per_user_limit
+
+    def _has_waiters(self, priority: Priority) -> bool:
+        return any(self._queues[p] for p in Priority if p <= priority)
+
+    def _start(self, user: str):
+        self._active += 1
+        self._in_flight[user] = self._in_flight.get(user, 0) + 1
+
+    async def _acquire(self, user: str, priority: Priority):
+        # Fast path: nothing queued at this priority or above
+        if self._can_start(user) and not self._has_waiters(priority):
+            self._start(user)
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(user, deque()).append(waiter)
+        # Waiters ahead may be blocked only by their own user's cap
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just before cancellation; hand the slot back
+                self._release(user)
+            else:
+                self._remove_waiter(priority, user, waiter)
+            raise
+
+    def _remove_waiter(self, priority: Priority, user: str, waiter: asyncio.Future):
+        waiters = self._queues[priority].get(user)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(waiter)
+        except ValueError:
+            pass
+        if not waiters:
+            del self._queues[priority][user]
+
+    def _release(self, user: str):
+        self._active -= 1
+        self._in_flight[user] -= 1
+        if not self._in_flight[user]:
+            del self._in_flight[user]
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._active < self.max_concurrency and self._grant_next():
+            pass
+
+    def _grant_next(self) -> bool:
+        for priority in Priority:
+            queue = self._queues[priority]
+            for user in list(queue):
+                # Rotate so the next grant at this priority starts with another user
+                queue.move_to_end(user)
+                if self._in_flight.get(user, 0) >= self.per_user_limit:
+                    continue
+
+                waiters = queue[user]
+                while waiters:
+                    waiter = waiters.popleft()
+                    # Skip waiters cancelled before their cleanup ran
+                    if not waiter.done():
+                        break
+                else:
+                    del queue[user]
+                    continue
+                if not waiters:
+                    del queue[user]
+                self._start(user)
+                waiter.set_result(None)
+                return True
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        users: Dict[str, Dict[str, int]] = {}
+        for user, count in self._in_flight.items():
+            users.setdefault(user, {"in_flight": 0, "queued": 0})["in_flight"] = count
+        for queue in self._queues.values():
+            for user, waiters in queue.items():
+                users.setdefault(user, {"in_flight": 0, "queued": 0})["queued"] += len(waiters)
+
+        return {
+            "active": self._active,
+            "max_concurrency": self.max_concurrency,
+            "per_user_limit": self.per_user_limit,
+            "queued": {
+                priority.name.lower(): sum(len(w) for w in self._queues[priority].values())
+                for priority in Priority
+            },
+            "users": users,
+        }
+
+# Singleton instance
+scheduler = UpstreamScheduler(
+    settings.UPSTREAM_MAX_CONCURRENCY, settings.UPSTREAM_PER_USER_LIMIT, settings.ACTIVITY_FILE_CONCURRENCY
+)
@@ -0,0 +1,282 @@
+import asyncio
+import json
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Set
+from app.services.cache import cache
+from app.services.detector import html_to_text
+
+logger = logging.getLogger(__name__)
+
+# Pending documents beyond this are dropped rather than growing memory unbounded
+MAX_QUEUE_SIZE = 1000
+
+# Bounds on index memory: document count and text kept per document for snippets
+MAX_DOCUMENTS = 5000
+MAX_SNIPPET_TEXT = 20000
+
+# How often each worker picks up documents cached by other workers and drops expired ones
+SYNC_INTERVAL = 60
+
+SNIPPET_RADIUS = 80
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+WHITESPACE_RE = re.compile(r"\s+")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "was", "with",
+}
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+def meta_key(doc_key: str) -> str:
+    return f"indexmeta:{doc_key}"
+
+@dataclass
+class IndexedDocument:
+    url: str
+    course_id: int
+    cmid: int
+    name: Optional[str]
+    text: str
+    length: int
+    terms: Set[str]
+    expires_at: float
+
+class ContentIndex:
+    """
+    Incremental in-memory inverted index over cleaned activity content,
+    scoped by course. Documents are indexed by a background worker, which
+    also syncs from the cache tier so every worker sees content cached by
+    the others, and drops documents once their cache entry expires.
+    """
+
+    def __init__(self):
+        self._docs: Dict[str, IndexedDocument] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._course_docs: Dict[int, Set[str]] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+        self._queue: Optional[asyncio.Queue] = None
+
+    async def add(
+        self,
+        doc_key: str,
+        url: str,
+        course_id: int,
+        cmid: int,
+        name: Optional[str],
+        html: str,
+        ttl: int,
+        tags: Optional[List[str]] = None
+    ):
+        """
+        Record a cached document's metadata in the cache tier and queue it
+        for indexing. Never waits on indexing.
+        """
+        expires_at = time.time() + ttl
+        meta = {"url": url, "course_id": course_id, "cmid": cmid, "name": name, "expires_at": expires_at}
+        await cache.set(meta_key(doc_key), json.dumps(meta), ttl=ttl, tags=tags)
+        self._submit(doc_key, meta, html)
+
+    async def ensure_indexed(self, doc_key: str, html: str):
+        """
+        Queue a document served from the cache if this worker hasn't indexed it
+        """
+        if doc_key in self._docs:
+            return
+        cached_meta = await cache.get(meta_key(doc_key))
+        if cached_meta:
+            self._submit(doc_key, json.loads(cached_meta), html)
+
+    def _submit(self, doc_key: str, meta: Dict[str, Any], html: str):
+        if self._queue is None:
+            logger.debug("Content index worker not running, skipping document")
+            return
+        try:
+            self._queue.put_nowait((doc_key, meta, html))
+        except asyncio.QueueFull:
+            logger.warning(f"Content index queue full, dropping {meta['url']}")
+
+    async def run(self):
+        self._queue = asyncio.Queue(maxsize=MAX_QUEUE_SIZE)
+        next_sync = 0.0
+        while True:
+            if time.monotonic() >= next_sync:
+                await self._sync()
+                next_sync = time.monotonic() + SYNC_INTERVAL
+
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout=max(next_sync - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                continue
+            try:
+                await asyncio.to_thread(self._index, *item)
+            except Exception as e:
+                logger.error(f"Failed to index content: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _sync(self):
+        try:
+            live = {key[len(meta_key("")):] for key in await cache.keys(meta_key("*"))}
+            with self._lock:
+                self._evict(time.time())
+                # Drop documents invalidated (possibly by another worker) since the last sync
+                for doc_key in [k for k in self._docs if k not in live]:
+                    self._remove(doc_key)
+
+            for doc_key in live:
+                key = meta_key(doc_key)
+                if doc_key in self._docs or len(self._docs) >= MAX_DOCUMENTS:
+                    continue
+                cached_meta = await cache.get(key, promote=False)
+                html = await cache.get(doc_key, promote=False)
+                if cached_meta and html:
+                    await asyncio.to_thread(self._index, doc_key, json.loads(cached_meta), html)
+        except Exception as e:
+            logger.warning(f"Content index sync failed: {e}")
+
+    def _index(self, doc_key: str, meta: Dict[str, Any], html: str):
+        text = WHITESPACE_RE.sub(" ", html_to_text(html)).strip()
+        name = meta.get("name")
+        counts = Counter(tokenize(text))
+        if name:
+            counts.update(tokenize(name))
+
+        doc = IndexedDocument(
+            url=meta["url"],
+            course_id=meta["course_id"],
+            cmid=meta["cmid"],
+            name=name,
+            text=text[:MAX_SNIPPET_TEXT],
+            length=sum(counts.values()),
+            terms=set(counts),
+            expires_at=meta["expires_at"],
+        )
+
+        with self._lock:
+            self._remove(doc_key)
+            self._docs[doc_key] = doc
+            self._total_length += doc.length
+            self._course_docs.setdefault(doc.course_id, set()).add(doc_key)
+            for term, tf in counts.items():
+                self._postings.setdefault(term, {})[doc_key] = tf
+            self._evict(time.time())
+
+        logger.debug(f"Indexed {doc.url} ({doc.length} terms)")
+
+    def _evict(self, now: float):
+        for doc_key in [k for k, doc in self._docs.items() if doc.expires_at <= now]:
+            self._remove(doc_key)
+        if len(self._docs) > MAX_DOCUMENTS:
+            by_expiry = sorted(self._docs, key=lambda k: self._docs[k].expires_at)
+            for doc_key in by_expiry[:len(self._docs) - MAX_DOCUMENTS]:
+                self._remove(doc_key)
+
+    def _remove(self, doc_key: str):
+        old = self._docs.pop(doc_key, None)
+        if old is None:
+            return
+        self._total_length -= old.length
+        self._course_docs.get(old.course_id, set()).discard(doc_key)
+        for term in old.terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_key, None)
+                if not postings:
+                    del self._postings[term]
+
+    def remove_course(self, course_id: int):
+        with self._lock:
+            for doc_key in list(self._course_docs.get(course_id, set())):
+                self._remove(doc_key)
+
+    def remove_activity(self, cmid: int):
+        with self._lock:
+            for doc_key in [k for k, doc in self._docs.items() if doc.cmid == cmid]:
+                self._remove(doc_key)
+
+    def clear(self):
+        with self._lock:
+            self._docs.clear()
+            self._postings.clear()
+            self._course_docs.clear()
+            self._total_length = 0
+
+    def search(self, query: str, course_ids: Iterable[int], limit: int = 20) -> List[Dict[str, Any]]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        with self._lock:
+            now = time.time()
+            allowed = set()
+            for course_id in course_ids:
+                allowed |= {k for k in self._course_docs.get(course_id, set()) if self._docs[k].expires_at > now}
+            if not allowed:
+                return []
+
+            n = len(self._docs)
+            avg_length = self._total_length / n if n else 0
+            scores: Dict[str, float] = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_key, tf in postings.items():
+                    if doc_key not in allowed:
+                        continue
+                    length_norm = 1 - B + B * self._docs[doc_key].length / avg_length
+                    scores[doc_key] = scores.get(doc_key, 0.0) + idf * tf * (K1 + 1) / (tf + K1 * length_norm)
+
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+            docs = [(self._docs[doc_key], score) for doc_key, score in ranked]
+
+        return [
+            {
+                "url": doc.url,
+                "course_id": doc.course_id,
+                "cmid": doc.cmid,
+                "name": doc.name,
+                "score": round(score, 4),
+                "snippet": make_snippet(doc.text, terms),
+            }
+            for doc, score in docs
+        ]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "documents": len(self._docs),
+            "terms": len(self._postings),
+            "pending": self._queue.qsize() if self._queue else 0,
+        }
+
+def make_snippet(text: str, terms: List[str]) -> str:
+    lower = text.lower()
+    positions = [m.start() for m in (re.search(rf"\b{re.escape(t)}\b", lower) for t in terms) if m]
+    pos = min(positions) if positions else 0
+
+    start = max(pos - SNIPPET_RADIUS, 0)
+    end = min(pos + SNIPPET_RADIUS, len(text))
+    snippet = text[start:end].strip()
+    if start > 0:
+        snippet = f"…{snippet}"
+    if end < len(text):
+        snippet = f"{snippet}…"
+    return snippet
+
+# Singleton instance
+content_index = ContentIndex()
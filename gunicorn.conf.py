@@ -0,0 +1,56 @@
+# Production server config: gunicorn main:app -c gunicorn.conf.py
+#
+# Each worker is a separate process with its own memory cache, search index
+# and upstream scheduler. Without REDIS_URL (and a shared IMAGE_PROXY_SECRET)
+# these are not shared: cache hits, search results and signed image URLs
+# depend on which worker answers. Upstream limits are split evenly per worker.
+# Run a single worker when there is no Redis.
+import math
+import os
+from app.config import settings
+
+def available_cpus() -> int:
+    """
+    CPUs this process may actually use: the cgroup quota inside containers,
+    otherwise the CPU affinity mask (not the host's CPU count).
+    """
+    cpus = len(os.sched_getaffinity(0))
+    try:
+        # cgroup v2
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = f.read().strip()
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = f.read().strip()
+        except OSError:
+            return cpus
+    if quota in ("max", "-1"):
+        return cpus
+    return max(1, min(cpus, math.ceil(int(quota) / int(period))))
+
+bind = f"{settings.HOST}:{settings.PORT}"
+workers = settings.WORKERS or (available_cpus() if settings.REDIS_URL else 1)
+# Picks uvloop/httptools when installed
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Import the app (bs4, cleaner rules, routers) once in the master so
+# forked workers start with everything already loaded
+preload_app = True
+
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+
+def on_starting(server):
+    # Exercise the parser once so its lazily imported pieces are loaded before forking
+    from app.services.cleaner import clean_html_content
+    clean_html_content("<div class='box'><p>warm-up</p></div>")
+
+def post_fork(server, worker):
+    # Split upstream limits by the worker count in effect, including a -w override
+    from app.services.scheduler import scheduler
+    scheduler.set_workers(server.cfg.workers)
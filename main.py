@@ -1,9 +1,13 @@
+import asyncio
 import logging
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import settings
 from app.routers import auth, courses, content, books
+from app.services.cache import cache
+from app.services.search import content_index
 import warnings
 
 # Suppress warnings
@@ -16,10 +20,33 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Upper bound on how long a worker waits for cache warm-up before serving
+CACHE_WARM_TIMEOUT = 10
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.CACHE_WARM_KEYS:
+        try:
+            warmed = await asyncio.wait_for(cache.warm(settings.CACHE_WARM_KEYS), CACHE_WARM_TIMEOUT)
+            logger.info(f"Warmed cache with {warmed} entries")
+        except Exception as e:
+            logger.warning(f"Cache warm-up failed: {e}")
+    
+    # Background indexing of cached content for /api/content/search
+    indexer = asyncio.create_task(content_index.run())
+    # Keep this worker's memory cache in step with invalidations from other workers
+    invalidations = asyncio.create_task(cache.listen_invalidations())
+    hits = asyncio.create_task(cache.flush_hits())
+    yield
+    indexer.cancel()
+    invalidations.cancel()
+    hits.cancel()
+
 app = FastAPI(
     title="MyLMS Backend",
     description="Python backend for MyLMS Dashboard - Moodle API integration",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # CORS Configuration
@@ -41,6 +68,7 @@ app.include_router(books.router, prefix="/api/books", tags=["books"])
 async def root():
     return {"message": "MyLMS Backend is running"}
 
+# Development server; production runs under gunicorn (see gunicorn.conf.py)
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
@@ -0,0 +1,88 @@
+import asyncio
+
+import httpx
+
+from app.config import settings
+from app.routers.content import fetch_activity_content
+from app.services.cache import cache
+from app.services.moodle import MoodleClient
+
+ACTIVITY_URL = f"{settings.MOODLE_URL}/mod/page/view.php?id=42"
+
+def file_url(name: str) -> str:
+    return f"{settings.MOODLE_URL}/webservice/pluginfile.php/1/mod_page/content/{name}"
+
+def moodle(files, downloads, delays=None, missing=()):
+    """
+    Mock Moodle serving one activity whose contents are the given (filename, timemodified) pairs
+    """
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "POST":
+            params = dict(httpx.QueryParams(request.content.decode()))
+            if params["wsfunction"] == "core_course_get_course_module":
+                return httpx.Response(200, json={"cm": {"course": 7, "name": "Week 1"}})
+            contents = [
+                {"filename": name, "fileurl": file_url(name), "timemodified": modified}
+                for name, modified in files
+            ]
+            return httpx.Response(200, json=[{"modules": [{"id": 42, "contents": contents}]}])
+
+        name = request.url.path.rsplit("/", 1)[-1]
+        await asyncio.sleep((delays or {}).get(name, 0))
+        # Recorded in completion order
+        downloads.append(name)
+        if name in missing:
+            return httpx.Response(404)
+        return httpx.Response(200, text=f"<p>Text of {name}</p>")
+
+    client = MoodleClient()
+    client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+async def load(client):
+    try:
+        return await fetch_activity_content(client, "token", ACTIVITY_URL)
+    finally:
+        await client.close()
+
+def test_file_order_is_kept_under_concurrent_downloads():
+    files = [("a.html", 1), ("b.html", 1), ("c.html", 1)]
+    # Earlier files finish last
+    delays = {"a.html": 0.05, "b.html": 0.02}
+
+    async def scenario():
+        await cache.clear()
+        downloads = []
+        return downloads, await load(moodle(files, downloads, delays))
+
+    downloads, activity = asyncio.run(scenario())
+
+    assert downloads == ["c.html", "b.html", "a.html"]
+    assert activity.html.split("\n\n") == [
+        "<p>Text of a.html</p>", "<p>Text of b.html</p>", "<p>Text of c.html</p>"
+    ]
+    assert (activity.course_id, activity.cmid, activity.name) == (7, 42, "Week 1")
+
+def test_failed_downloads_are_skipped():
+    async def scenario():
+        await cache.clear()
+        return await load(moodle([("a.html", 1), ("b.html", 1)], [], missing={"a.html"}))
+
+    activity = asyncio.run(scenario())
+
+    assert "a.html" not in activity.html
+    assert "Text of b.html" in activity.html
+
+def test_only_modified_files_are_fetched_again():
+    async def scenario():
+        await cache.clear()
+        first, second = [], []
+        await load(moodle([("a.html", 1), ("b.html", 1)], first))
+        activity = await load(moodle([("a.html", 1), ("b.html", 2)], second))
+        return first, second, activity
+
+    first, second, activity = asyncio.run(scenario())
+
+    assert sorted(first) == ["a.html", "b.html"]
+    assert second == ["b.html"]
+    assert "Text of a.html" in activity.html and "Text of b.html" in activity.html
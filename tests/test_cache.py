@@ -0,0 +1,58 @@
+import time
+
+from fastapi.testclient import TestClient
+
+from app.services import cache as cache_module
+from app.services.cache import cache, content_tags
+from main import app
+
+ACTIVITY_URL = "https://moodle.example.com/mod/page/view.php?id=70"
+
+def seed(client):
+    entries = {
+        f"activity:{cache.url_hash(ACTIVITY_URL)}": content_tags("activity", 7, 70),
+        "fragment:a:1": content_tags("fragment", 7, 70),
+        "fragment:b:1": content_tags("fragment", 7, 71),
+        "fragment:c:1": content_tags("fragment", 8, 80),
+    }
+    for key, tags in entries.items():
+        client.portal.call(cache.set, key, "<p>cached</p>", 3600, tags)
+
+def cached(client, key):
+    return client.portal.call(cache.get, key) is not None
+
+def test_invalidate_activity_drops_only_that_activity():
+    with TestClient(app) as client:
+        client.delete("/api/content/cache")
+        seed(client)
+
+        response = client.delete("/api/content/cache/activity", params={"url": ACTIVITY_URL})
+
+        assert response.json() == {"success": True, "invalidated": 2}
+        assert not cached(client, f"activity:{cache.url_hash(ACTIVITY_URL)}")
+        assert not cached(client, "fragment:a:1")
+        assert cached(client, "fragment:b:1") and cached(client, "fragment:c:1")
+
+def test_invalidate_course_drops_only_that_course():
+    with TestClient(app) as client:
+        client.delete("/api/content/cache")
+        seed(client)
+
+        response = client.delete("/api/content/cache/course/7")
+
+        assert response.json() == {"success": True, "invalidated": 3}
+        assert not cached(client, "fragment:b:1")
+        assert cached(client, "fragment:c:1")
+
+def test_expired_entries_leave_the_tag_index(monkeypatch):
+    with TestClient(app) as client:
+        client.delete("/api/content/cache")
+        client.portal.call(cache.set, "fragment:old:1", "<p>old</p>", 1, content_tags("fragment", 9, 90))
+
+        # Never read again; the next write after the purge interval sweeps it
+        later = time.time() + cache_module.PURGE_INTERVAL + 2
+        monkeypatch.setattr(cache_module.time, "time", lambda: later)
+        client.portal.call(cache.set, "fragment:new:1", "<p>new</p>", 3600)
+
+    assert "fragment:old:1" not in cache_module._memory_cache
+    assert "course:9" not in cache_module._tag_index
@@ -0,0 +1,50 @@
+import csv
+
+from app.services import catalogue as catalogue_module
+from app.services.catalogue import Catalogue, import_catalogue
+
+def build(tmp_path, rows):
+    dump = tmp_path / "dump.csv"
+    with open(dump, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["MD5", "Title", "Authors", "Year"])
+        writer.writerows(rows)
+    db = tmp_path / "catalogue.db"
+    import_catalogue(str(dump), str(db))
+    return Catalogue(str(db))
+
+def test_prefix_search_ranks_title_matches(tmp_path):
+    catalogue = build(tmp_path, [
+        ["a" * 32, "Organic Chemistry", "Clayden", "2012"],
+        ["b" * 32, "Physics for Scientists", "Organ", "2010"],
+        ["c" * 32, "Linear Algebra", "Strang", "2016"],
+    ])
+
+    result = catalogue.search("organ")
+
+    assert [b["md5"] for b in result["books"]] == ["a" * 32, "b" * 32]
+    assert result["total"] == 2 and result["total_exact"]
+    assert catalogue.get_book("C" * 32)["title"] == "Linear Algebra"
+
+def test_total_is_capped_for_broad_queries(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalogue_module, "MAX_COUNTED_MATCHES", 5)
+    catalogue = build(tmp_path, [[f"{i:032x}", f"Introduction {i}", "Author", "2000"] for i in range(20)])
+
+    result = catalogue.search("intro", page=1, limit=3)
+
+    assert len(result["books"]) == 3
+    assert result["total"] == 5 and not result["total_exact"]
+
+def test_broad_queries_rank_every_match(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalogue_module, "MAX_COUNTED_MATCHES", 50)
+    rows = [[f"{i:032x}", f"Calculus notes part {i}", "Student", "2020"] for i in range(300)]
+    rows.append(["f" * 32, "Calculus", "Stewart", "2015"])
+    catalogue = build(tmp_path, rows)
+
+    first = catalogue.search("calculus", limit=5)
+    later = catalogue.search("Calculus", page=20, limit=5)
+
+    assert first["books"][0]["md5"] == "f" * 32
+    assert not first["total_exact"]
+    assert len(later["books"]) == 5
+    assert later["query"] == "Calculus"
@@ -0,0 +1,49 @@
+from fastapi.testclient import TestClient
+
+from app.services import cache as cache_module
+from app.services.detector import detect_books, store_activity_detection
+from main import app
+
+PRESCRIBED = """
+<div class="box"><h3>Prescribed Reading</h3>
+<p>Smith, J. &amp; Doe, A. (2019). Intro to Things. Pearson.</p>
+<p>Clean Code by R. C. Martin, 2008</p>
+<p>Submit chapter 3 by Friday</p>
+<p>Hand in the essay by End of Week</p>
+</div>
+"""
+
+def test_prescribed_reading_citations():
+    citations = [b for b in detect_books(PRESCRIBED) if b["type"] == "citation"]
+
+    assert citations == [
+        {"type": "citation", "title": "Intro to Things", "author": "Smith, J. & Doe, A.", "year": "2019"},
+        {"type": "citation", "title": "Clean Code", "author": "R. C. Martin"},
+    ]
+
+def test_isbns_are_checksum_validated():
+    books = detect_books("<p>ISBN 0-13-110362-8, ISBN 0-13-110362-9 and 978-0-596-52068-7</p>")
+
+    assert [b["isbn"] for b in books] == ["9780131103627", "9780596520687"]
+
+def test_served_content_reuses_activity_detection():
+    url = "https://moodle.example.com/mod/page/view.php?id=42"
+    with TestClient(app) as client:
+        client.portal.call(store_activity_detection, url, detect_books(PRESCRIBED))
+        # Served content is cleaned (no prescribed box) and carries signed image URLs
+        served = '<p>Week 1</p><img src="http://testserver/api/content/image?src=x&amp;g=1&amp;exp=2&amp;sig=3">'
+
+        by_activity = client.post("/api/books/detect", json={"html": served, "url": url}).json()["books"]
+        by_html = client.post("/api/books/detect", json={"html": served}).json()["books"]
+
+    assert [b["title"] for b in by_activity] == ["Intro to Things", "Clean Code"]
+    assert by_html == []
+
+def test_posted_html_is_bounded_and_not_cached():
+    with TestClient(app) as client:
+        before = len(cache_module._memory_cache)
+        assert client.post("/api/books/detect/batch", json={"documents": ["<p>x</p>"] * 51}).status_code == 422
+        assert client.post("/api/books/detect", json={"html": "x" * 1_000_001}).status_code == 422
+        assert client.post("/api/books/detect/batch", json={"documents": [PRESCRIBED, "<p>y</p>"]}).status_code == 200
+
+    assert len(cache_module._memory_cache) == before
@@ -0,0 +1,120 @@
+import asyncio
+import html
+import io
+import re
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.dependencies import get_moodle_client
+from app.services.cache import cache
+from app.services.cleaner import clean_html_with_token
+from app.services.images import ImageCache, image_cache
+from app.services.moodle import MoodleClient
+from main import app
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+ACTIVITY_URL = f"{settings.MOODLE_URL}/mod/page/view.php?id=42"
+FILE_URL = f"{settings.MOODLE_URL}/webservice/pluginfile.php/1/mod_page/content/3/index.html"
+
+@pytest.fixture
+def upstream_requests(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_cache, "directory", str(tmp_path))
+    monkeypatch.setattr(image_cache, "_total_bytes", None)
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, content=PNG, headers={"content-type": "image/png"})
+
+    async def moodle_client():
+        client = MoodleClient()
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            yield client
+        finally:
+            await client.close()
+
+    app.dependency_overrides[get_moodle_client] = moodle_client
+    yield requests
+    app.dependency_overrides.clear()
+
+def test_image_loads_after_cached_content_hit(upstream_requests):
+    with TestClient(app) as client:
+        # Content cleaned by another worker or before a restart
+        cleaned = clean_html_with_token('<p><img src="images/fig1.png"></p>', "cleaner-token", FILE_URL)
+        client.portal.call(cache.set, f"activity:{cache.url_hash(ACTIVITY_URL)}", cleaned)
+
+        response = client.get(
+            "/api/content/activity",
+            params={"url": ACTIVITY_URL},
+            headers={"Authorization": "Bearer reader-token"},
+        )
+        assert response.json()["cached"] is True
+        assert "token" not in response.json()["content"]
+
+        src = html.unescape(re.search(r'src="([^"]+)"', response.json()["content"]).group(1))
+        # Absolute, so frontends on other origins load it from this server
+        assert src.startswith("http://testserver/api/content/image?")
+        image = client.get(src)
+
+    assert image.status_code == 200
+    assert image.content == PNG
+    assert image.headers["cache-control"].startswith("private")
+    assert len(upstream_requests) == 1
+    fetched = str(upstream_requests[0].url)
+    assert fetched.startswith(f"{settings.MOODLE_URL}/webservice/pluginfile.php/1/mod_page/content/3/images/fig1.png")
+    assert "token=reader-token" in fetched
+
+def test_image_requires_signature(upstream_requests):
+    src = f"{settings.MOODLE_URL}/pluginfile.php/1/fig.png"
+    with TestClient(app) as client:
+        assert client.get("/api/content/image", params={"src": src}).status_code == 401
+        forged = {"src": src, "g": "x", "exp": "9999999999", "sig": "0" * 32}
+        assert client.get("/api/content/image", params=forged).status_code == 401
+    assert upstream_requests == []
+
+def test_bearer_token_does_not_bypass_signature(upstream_requests):
+    with TestClient(app) as client:
+        cleaned = clean_html_with_token('<p><img src="images/fig1.png"></p>', "cleaner-token", FILE_URL)
+        client.portal.call(cache.set, f"activity:{cache.url_hash(ACTIVITY_URL)}", cleaned)
+        content = client.get(
+            "/api/content/activity",
+            params={"url": ACTIVITY_URL},
+            headers={"Authorization": "Bearer reader-token"},
+        ).json()["content"]
+        src = html.unescape(re.search(r'src="([^"]+)"', content).group(1))
+        assert client.get(src).status_code == 200
+
+        # The image is now on disk; a made-up token must not be enough to read it
+        unsigned = src.split("&g=")[0]
+        response = client.get(unsigned, headers={"Authorization": "Bearer made-up"})
+
+    assert response.status_code == 401
+    assert len(upstream_requests) == 1
+
+def test_widths_share_variants(tmp_path, monkeypatch):
+    Image = pytest.importorskip("PIL.Image")
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (2000, 1000)).save(buffer, format="PNG")
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=buffer.getvalue(), headers={"content-type": "image/png"})
+
+    async def scenario():
+        images = ImageCache(str(tmp_path), 10 * 1024 * 1024)
+        client = MoodleClient()
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        src = f"{settings.MOODLE_URL}/pluginfile.php/1/big.png"
+        results = await asyncio.gather(*[images.get_or_fetch(client, "token", src, w) for w in (100, 101, 102, 103)])
+        await client.close()
+        return results
+
+    results = asyncio.run(scenario())
+
+    assert {r.path for r in results} == {results[0].path}
+    assert results[0].path.endswith("-w320")
+    assert len([p for p in tmp_path.rglob("*-w*") if not p.name.endswith(".json")]) == 1
@@ -0,0 +1,34 @@
+import asyncio
+
+import httpx
+
+from app.services.moodle import MoodleClient
+from app.services.scheduler import UpstreamScheduler, scheduler
+
+def test_limits_are_split_across_workers():
+    split = UpstreamScheduler(32, 12, min_per_user=2)
+    split.set_workers(4)
+    assert (split.max_concurrency, split.per_user_limit) == (8, 3)
+
+    # Each worker keeps enough per-user slots for one activity's parallel downloads
+    split = UpstreamScheduler(32, 6, min_per_user=4)
+    split.set_workers(4)
+    assert (split.max_concurrency, split.per_user_limit) == (8, 4)
+
+    split = UpstreamScheduler(8, 6, min_per_user=4)
+    split.set_workers(4)
+    assert (split.max_concurrency, split.per_user_limit) == (4, 4)
+
+def test_streamed_downloads_hold_a_scheduler_slot():
+    async def scenario():
+        moodle = MoodleClient()
+        moodle.client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=b"img")))
+        async with moodle.stream_file("token", "https://moodle.test/pluginfile.php/1/a.png") as response:
+            during = scheduler.stats()["active"]
+            body = await response.aread()
+        await moodle.client.aclose()
+        return during, scheduler.stats()["active"], body
+
+    during, after, body = asyncio.run(scenario())
+
+    assert (during, after, body) == (1, 0, b"img")
@@ -0,0 +1,70 @@
+import asyncio
+import json
+import time
+
+from app.services.cache import cache
+from app.services.search import ContentIndex, meta_key
+
+def test_index_syncs_content_cached_elsewhere():
+    async def scenario():
+        # Cached by another worker: content and index metadata are in the cache tier only
+        meta = {"url": "u1", "course_id": 7, "cmid": 70, "name": "Week 1", "expires_at": time.time() + 60}
+        await cache.set("activity:synced", "<p>Mitochondria are the powerhouse of the cell.</p>")
+        await cache.set(meta_key("activity:synced"), json.dumps(meta))
+
+        index = ContentIndex()
+        worker = asyncio.create_task(index.run())
+        await asyncio.sleep(0.1)
+        worker.cancel()
+        return index.search("mitochondria", [7]), index.search("mitochondria", [8])
+
+    in_course, other_course = asyncio.run(scenario())
+
+    assert [r["url"] for r in in_course] == ["u1"]
+    assert "powerhouse" in in_course[0]["snippet"]
+    assert other_course == []
+
+def test_expired_documents_are_not_returned():
+    async def scenario():
+        index = ContentIndex()
+        worker = asyncio.create_task(index.run())
+        await asyncio.sleep(0)
+        await index.add("activity:short", "u2", 7, 71, None, "<p>Photosynthesis</p>", ttl=1)
+        await index._queue.join()
+        found = index.search("photosynthesis", [7])
+        await asyncio.sleep(1.1)
+        worker.cancel()
+        return found, index.search("photosynthesis", [7])
+
+    before, after = asyncio.run(scenario())
+
+    assert [r["url"] for r in before] == ["u2"]
+    assert after == []
+
+def test_invalidation_drops_indexed_documents():
+    async def scenario():
+        index = ContentIndex()
+        worker = asyncio.create_task(index.run())
+        await asyncio.sleep(0)
+        await index.add("activity:a", "ua", 9, 90, None, "<p>Thermodynamics</p>", ttl=60, tags=["cmid:90"])
+        await index.add("activity:b", "ub", 9, 91, None, "<p>Thermodynamics again</p>", ttl=60, tags=["cmid:91"])
+        await index._queue.join()
+
+        index.remove_activity(90)
+        after_activity = index.search("thermodynamics", [9])
+        index.remove_course(9)
+        after_course = index.search("thermodynamics", [9])
+
+        # Invalidated elsewhere: the metadata is gone from the cache tier, so the next sync drops it
+        await index.add("activity:c", "uc", 9, 92, None, "<p>Thermodynamics</p>", ttl=60, tags=["cmid:92"])
+        await index._queue.join()
+        await cache.invalidate_tags("cmid:92")
+        await index._sync()
+        worker.cancel()
+        return after_activity, after_course, index.search("thermodynamics", [9])
+
+    after_activity, after_course, after_sync = asyncio.run(scenario())
+
+    assert [r["url"] for r in after_activity] == ["ub"]
+    assert after_course == []
+    assert after_sync == []